@@ -0,0 +1,161 @@
+import importlib
+import re
+import threading
+import time
+from functools import lru_cache
+
+import pandas as pd
+from abc import ABC, abstractmethod
+
+from statement import Statement, DATE_FORMAT, to_paise
+
+# Bump whenever parsing output changes so cached statements are re-parsed.
+PARSER_VERSION = 8
+# Raw text fields every parser collects per row; to_frame types them.
+STATEMENT_COLUMNS = ["date", "summary", "ref", "debit", "credit", "balance"]
+DATE = r"[ \t]*\d{2}/\d{2}/\d{2}[ \t]*"
+FIELD = r"[^,\n]*"
+
+# Parsers are registered by name with the module that holds them and a regex matched (multiline) against
+# the first few KB of an upload. Modules are only imported once a statement of that bank shows up.
+PARSERS = {}
+_banks = {}
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+def register_parser(name, module, signature):
+    PARSERS[name] = (module, signature)
+    signatures.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def signatures():
+    return re.compile("|".join(f"(?P<{name}>{signature})" for name, (_, signature) in PARSERS.items()),
+                      re.MULTILINE)
+
+
+register_parser("HDFC", "banks.hdfc", rf"^[ \t]*Date[ \t]*,[ \t]*Narration|^{DATE}(?:,{FIELD}){{6}}$")
+register_parser("SBI", "banks.sbi", rf"^Txn Date|^{DATE},{DATE},")
+
+
+def record_timing(name, stage, seconds, rows=0):
+    with _timings_lock:
+        timings = _timings.setdefault(name, {})
+        timings[stage + "_calls"] = timings.get(stage + "_calls", 0) + 1
+        timings[stage + "_seconds"] = timings.get(stage + "_seconds", 0.0) + seconds
+        if rows:
+            timings[stage + "_rows"] = timings.get(stage + "_rows", 0) + rows
+
+
+def parser_timings():
+    with _timings_lock:
+        return {name: dict(timings) for name, timings in _timings.items()}
+
+
+def get_bank(name):
+    if name not in _banks:
+        if name not in PARSERS:
+            raise ValueError(f"Invalid Bank Provided: {name}")
+        started = time.perf_counter()
+        importlib.import_module(PARSERS[name][0])
+        record_timing(name, "import", time.perf_counter() - started)
+    return _banks[name]
+
+
+def detect_bank(head_text):
+    started = time.perf_counter()
+    match = signatures().search(head_text)
+    name = match.lastgroup if match else None
+    record_timing(name or "unknown", "detect", time.perf_counter() - started)
+    return name
+
+
+def parse_statement(name, string_data):
+    started = time.perf_counter()
+    statement = get_bank(name).load_data(string_data)
+    record_timing(name, "parse", time.perf_counter() - started, len(statement))
+    return statement
+
+
+def parse_amounts(amounts, column):
+    # Paise for each amount, missing where blank. Anything else that is not a number fails the parse, like the
+    # float() calls this replaced, rather than quietly turning into zero.
+    amounts = pd.Series(amounts, dtype=object)
+    paise = to_paise(amounts)
+    invalid = paise.isna() & (amounts.str.strip() != "")
+    if invalid.any():
+        raise ValueError(f"{int(invalid.sum())} {column} amounts are not numbers, e.g. {amounts[invalid].iloc[0]!r}")
+    return paise
+
+
+def to_frame(columns, bank):
+    frame = pd.DataFrame({
+        "date": pd.to_datetime(pd.Series(columns["date"], dtype=object).str.strip(), format=DATE_FORMAT,
+                               errors="coerce"),
+        "summary": pd.Series(columns["summary"], dtype="string[pyarrow]"),
+        "ref": pd.Series(columns["ref"], dtype="string[pyarrow]"),
+        "debit_paise": parse_amounts(columns["debit"], "debit").fillna(0).astype("int64"),
+        "credit_paise": parse_amounts(columns["credit"], "credit").fillna(0).astype("int64"),
+        "balance_paise": parse_amounts(columns["balance"], "balance"),
+    })
+    frame["bank"] = pd.Categorical([bank.name] * len(frame))
+    frame["dividend"] = (frame["credit_paise"] > 0) & bank.dividend_mask(frame["summary"]).astype(bool)
+    frame["payer"] = pd.Series(pd.NA, index=frame.index, dtype="string[pyarrow]")
+    frame.loc[frame["dividend"], "payer"] = bank.payers(frame["summary"][frame["dividend"]])
+    return frame
+
+
+@lru_cache(maxsize=None)
+def join_patterns(patterns):
+    if not patterns:
+        return None
+    return "|".join(f"(?:{pattern})" for pattern in patterns)
+
+
+def clean_amount(amount):
+    return amount.strip().replace('"', '').replace("'", "")
+
+
+class Bank(ABC):
+    name = None
+    # Regexes (RE2 compatible, as they also run through pyarrow) matched anywhere in the raw summary.
+    # A row is a dividend when it matches an include pattern and no exclude pattern.
+    dividend_include = ()
+    dividend_exclude = ()
+    # Regex whose first group pulls the paying company out of a dividend summary.
+    payer_pattern = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        if cls.name is not None:
+            _banks[cls.name] = cls()
+
+    @abstractmethod
+    def sanitise(self, stri):
+        pass
+
+    @abstractmethod
+    def load_frame(self, string_data):
+        pass
+
+    def load_data(self, string_data):
+        return Statement(self.load_frame(string_data))
+
+    def dividend_mask(self, summaries):
+        include = join_patterns(self.dividend_include)
+        exclude = join_patterns(self.dividend_exclude)
+        if include is None:
+            return pd.Series(False, index=summaries.index)
+        mask = summaries.str.contains(include, na=False)
+        if exclude is not None:
+            mask &= ~summaries.str.contains(exclude, na=False)
+        return mask
+
+    def payers(self, summaries):
+        stripped = summaries.str.strip()
+        if self.payer_pattern is None:
+            return stripped
+        payers = summaries.str.extract(self.payer_pattern, expand=False).str.strip()
+        return payers.mask(payers.isna() | (payers == ""), stripped)
+
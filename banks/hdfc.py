@@ -0,0 +1,25 @@
+from banks import Bank, STATEMENT_COLUMNS, to_frame
+
+
+class HDFC(Bank):
+    name = "HDFC"
+    dividend_include = ("ACH C-", " DIV ", " DIV[0-9]")
+    dividend_exclude = ("^NEFT", "^UPI")
+    payer_pattern = r"^\s*(?:ACH C-\s*)?([^-/]+?)\s*(?:-|/|\bDIV|$)"
+
+    def sanitise(self, stri):
+        return stri.strip()
+
+    def load_frame(self, string_data):
+        columns = {name: [] for name in STATEMENT_COLUMNS}
+        for line in string_data:
+            if line.count(",") == 6:
+                dt, summary, vdt, debit, credit, rNumber, closingBalance = line.split(",")
+                if dt is not None and dt.count("/") == 2:
+                    columns["date"].append(dt)
+                    columns["summary"].append(summary)
+                    columns["ref"].append(rNumber.strip())
+                    columns["debit"].append(debit.strip())
+                    columns["credit"].append(credit.strip())
+                    columns["balance"].append(closingBalance.strip())
+        return to_frame(columns, self)
@@ -0,0 +1,40 @@
+import re
+
+from banks import Bank, STATEMENT_COLUMNS, clean_amount, to_frame
+
+THOUSANDS_SEPARATOR = re.compile(r",(?=\d)(?<=\d,)")
+
+
+class SBI(Bank):
+    name = "SBI"
+    dividend_include = ("-ACHCr",)
+    payer_pattern = r"ACHCr\s*(?:NACH\s*)?([^-/*]+?)\s*(?:-|/|\*|$)"
+
+    def sanitise(self, stri):
+        # Drops thousands separators past the first 40 characters in one pass. The first comma after a
+        # TO TRANSFER/TRANSFER TO marker delimits the description, so the scan is split around it.
+        markers = (stri.find("TO TRANSFER"), stri.find("TRANSFER TO"))
+        keep = sorted({stri.find(",", index + 1) for index in markers if index > -1})
+        parts = []
+        start = 40
+        for index in keep:
+            if index > start:
+                parts.append(THOUSANDS_SEPARATOR.sub("", stri[start:index]))
+                start = index + 1
+        parts.append(THOUSANDS_SEPARATOR.sub("", stri[start:]))
+        return stri[:40] + ",".join(parts)
+
+    def load_frame(self, string_data):
+        columns = {name: [] for name in STATEMENT_COLUMNS}
+        for line in string_data:
+            line = self.sanitise(line)
+            if line.count(",") == 7:
+                dt, vDt, summary, ref, debit, credit, balance, nothing = line.split(",")
+                if line.startswith("Txn") == False and (len(debit) > 0 or len(credit) > 0):
+                    columns["date"].append(dt)
+                    columns["summary"].append(summary)
+                    columns["ref"].append(ref.strip())
+                    columns["debit"].append(clean_amount(debit))
+                    columns["credit"].append(clean_amount(credit))
+                    columns["balance"].append(clean_amount(balance))
+        return to_frame(columns, self)
@@ -0,0 +1,400 @@
+import argparse
+import json
+import math
+import random
+import subprocess
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+import pandas as pd
+import pyarrow as pa
+
+from banks import parse_statement
+from banks.hdfc import HDFC
+from banks.sbi import SBI
+from formatting import format_inr
+from search import SearchIndex
+
+SIZES = [10_000, 100_000, 1_000_000]
+# Share of generated lines that are broken in ways the parsers have to skip.
+MALFORMED = 0.01
+HDFC_HEADER = "Date ,Narration ,Value Dat ,Debit Amount ,Credit Amount ,Chq/Ref Number ,Closing Balance"
+SBI_HEADER = "Txn Date,Value Date,Description,Ref No./Cheque No.,Debit,Credit,Balance,"
+QUERIES = {
+    "HDFC": {
+        "analyse": ("DEBIT", 5000, 100000, date(2021, 1, 1), date(2023, 12, 31), ""),
+        "contains": ("DEBIT", 5000, 100000, date(2021, 1, 1), date(2023, 12, 31), "swiggy"),
+    },
+    "SBI": {
+        "analyse": ("CREDIT", 1000, 1500000, date(2020, 4, 1), date(2024, 3, 31), ""),
+        "contains": ("CREDIT", 1000, 1500000, date(2020, 4, 1), date(2024, 3, 31), "salary"),
+    },
+}
+
+
+def malformed_line(rnd, line):
+    # Blank lines, rows cut short, stray commas in the description and dates in another format.
+    kind = rnd.randrange(4)
+    if kind == 0:
+        return ""
+    fields = line.split(",")
+    if kind == 1:
+        return ",".join(fields[:4])
+    if kind == 2:
+        return ",".join(fields[:2] + ["PAYMENT, REVERSED"] + fields[2:])
+    return ",".join(["2021-03-01"] + fields[1:])
+
+
+def hdfc_lines(rows, seed=7, malformed=0.0):
+    rnd = random.Random(seed)
+    broken = random.Random(seed + 1)
+    start = date(2020, 4, 1)
+    summaries = ["UPI-SWIGGY-SWIGGY@ICICI", "NEFT CR-HDFC0000001-SALARY", "ACH C- ITC LIMITED DIV",
+                 "POS 416021XXXXXX1234 AMAZON", "IMPS-P2A-RENT", "ACH C- INFOSYS LTD-FIN DIV2023",
+                 "NEFT CR-KOTAK0000001-FINAL DIV 2023"]
+    lines = [HDFC_HEADER]
+    for i in range(rows):
+        dt = (start + timedelta(days=i * 1500 // rows)).strftime("%d/%m/%y")
+        amount = "%.2f" % rnd.uniform(10, 200000)
+        debit, credit = (amount, "") if rnd.random() < 0.7 else ("", amount)
+        line = ",".join([dt, rnd.choice(summaries), dt, debit, credit, "%016d" % i, "100000.00"])
+        lines.append(malformed_line(broken, line) if malformed and broken.random() < malformed else line)
+    return lines
+
+
+def inr_amount(rnd):
+    return "{:,.2f}".format(rnd.uniform(10, 2000000))
+
+
+def sbi_lines(rows, seed=7, malformed=0.0):
+    rnd = random.Random(seed)
+    broken = random.Random(seed + 1)
+    start = date(2020, 4, 1)
+    summaries = ["BY TRANSFER-NEFT*ICIC0000001*ITC LIMITED DIVIDEND-ACHCr", "TO TRANSFER-UPI/DR/312345/SWIGGY/YBL/9,8",
+                 "DEBIT-ATMCard AMC 4,123 XX1234", "BY TRANSFER-INB IMPS/P2A/123,456/SALARY", "CASH DEPOSIT SELF",
+                 "TO TRANSFER-INB RENT PAYMENT"]
+    lines = [SBI_HEADER]
+    for i in range(rows):
+        dt = (start + timedelta(days=i * 1500 // rows)).strftime("%d/%m/%y")
+        summary = rnd.choice(summaries)
+        ref = "TRANSFER TO 4897691162094" if summary.startswith("TO TRANSFER") else "%012d" % i
+        debit, credit = ('"%s"' % inr_amount(rnd), "") if rnd.random() < 0.7 else ("", '"%s"' % inr_amount(rnd))
+        line = ",".join([dt, dt, summary, ref, debit, credit, '"%s"' % inr_amount(rnd), ""])
+        lines.append(malformed_line(broken, line) if malformed and broken.random() < malformed else line)
+    return lines
+
+
+GENERATORS = {"HDFC": hdfc_lines, "SBI": sbi_lines}
+
+
+def legacy_sanitise(stri):
+    special_chars = ["$", "#", "@"]
+    special_one = ''
+    to_transfer_index = stri.find("TO TRANSFER")
+    transfer_to_index = stri.find("TRANSFER TO")
+    ignore_index = []
+    if to_transfer_index > -1:
+        for i in range(to_transfer_index + 1, len(stri)):
+            if stri[i] == ",":
+                ignore_index.append(i)
+                break
+    if transfer_to_index > -1:
+        for i in range(transfer_to_index + 1, len(stri)):
+            if stri[i] == ",":
+                ignore_index.append(i)
+                break
+
+    for sp in special_chars:
+        if sp not in stri:
+            special_one = sp
+            break
+    all_index = [i for i, ltr in enumerate(stri) if ltr == ","]
+    for index in all_index:
+        if index > 40 and index not in ignore_index and index + 1 < len(stri) and stri[index + 1].isdigit() and \
+                stri[index - 1].isdigit():
+            stri = stri[: index] + special_one + stri[index + 1:]
+
+    return stri.replace(special_one, "")
+
+
+def legacy_is_dividend(summary):
+    if summary is None or len(summary) < 3:
+        return False
+    if summary.startswith("NEFT") or summary.startswith("UPI"):
+        return False
+    if "ACH C-" in summary or " DIV " in summary:
+        return True
+    for i in range(0, 10):
+        x = " DIV" + str(i)
+        if x in summary:
+            return True
+    return False
+
+
+def legacy_format_inr(n):
+    s = str(int(n))
+    s = s[::-1]
+    groups = []
+    i = 0
+    while i < len(s):
+        if i == 0:
+            groups.append(s[i:i+3])
+        else:
+            groups.append(s[i:i+2])
+        i += 2 if i > 0 else 3
+    return ','.join(groups)[::-1]
+
+
+def legacy_valid_lines(bank, lines):
+    # Row filters of the original per-bank load_data, which kept the raw lines.
+    if bank == "HDFC":
+        return [line for line in lines if line.count(",") == 6 and line.split(",")[0].count("/") == 2]
+    valid = []
+    for line in map(legacy_sanitise, lines):
+        if line.count(",") == 7 and not line.startswith("Txn"):
+            fields = line.split(",")
+            if len(fields[4]) > 0 or len(fields[5]) > 0:
+                valid.append(line)
+    return valid
+
+
+def legacy_fields(bank, line):
+    if bank == "HDFC":
+        dt, summary, vdt, debit, credit, rNumber, closingBalance = map(str.strip, line.split(","))
+    else:
+        dt, vDt, summary, ref, debit, credit, balance, nothing = map(str.strip, line.split(","))
+    debit = debit.replace('"', '').replace("'", "")
+    credit = credit.replace('"', '').replace("'", "")
+    return dt, summary, float(debit) if len(debit) > 0 else 0, float(credit) if len(credit) > 0 else 0
+
+
+def legacy_date(dt):
+    try:
+        return datetime.strptime(dt, "%d/%m/%y").date()
+    except ValueError:
+        return None
+
+
+def legacy_analyse(bank, valid_lines, transaction_type, threshold_amount, max_amount, from_date, to_date,
+                   contains_text):
+    res_dataframe = {
+        'Date': [],
+        'Summary': [],
+        'Amount': []
+    }
+    for line in valid_lines:
+        dt, summary, debitAmount, creditAmount = legacy_fields(bank, line)
+        targetAmount = debitAmount if (transaction_type == "DEBIT") else creditAmount
+
+        # The original raised on undated rows, which SBI statements keep. They now never match a date range.
+        line_date = legacy_date(dt)
+        if line_date is None:
+            continue
+
+        summary_filter_passed = True
+        if contains_text and len(contains_text.strip()) > 0:
+            summary_filter_passed = contains_text.lower() in summary.lower()
+
+        if from_date <= line_date <= to_date and targetAmount >= threshold_amount and targetAmount <= max_amount and summary_filter_passed:
+            res_dataframe['Date'].append(dt)
+            res_dataframe['Summary'].append(summary)
+            res_dataframe['Amount'].append(targetAmount)
+    return res_dataframe
+
+
+def golden(bank, lines):
+    # Expected results for a generated statement, computed with the original line-by-line code.
+    valid = legacy_valid_lines(bank, lines)
+    fields = [legacy_fields(bank, line) for line in valid]
+    dates = [legacy_date(dt) for dt, _, _, _ in fields]
+    is_dividend = legacy_is_dividend if bank == "HDFC" else lambda summary: "-ACHCr" in summary
+    # Dividends are rolled up by financial year, so undated rows are left out of the totals.
+    dividends = [credit for (_, summary, _, credit), day in zip(fields, dates)
+                 if day is not None and credit > 0 and is_dividend(summary)]
+    dates = [day for day in dates if day is not None]
+    expected = {
+        "rows": len(valid),
+        "date_range": (min(dates), max(dates)) if dates else (None, None),
+        "dividend_count": len(dividends),
+        "dividend_total": sum(dividends),
+    }
+    for stage, query in QUERIES[bank].items():
+        amounts = legacy_analyse(bank, valid, *query)["Amount"]
+        expected[stage + "_count"] = len(amounts)
+        expected[stage + "_total"] = sum(amounts)
+    return expected
+
+
+def summarise(bank, statement):
+    dividends = statement.calculate_dividend()
+    actual = {
+        "rows": len(statement),
+        "date_range": statement.date_range(),
+        "dividend_count": len(dividends["res_dataframe"]["Credit Amount"]),
+        "dividend_total": dividends["res_dividend"],
+    }
+    for stage, query in QUERIES[bank].items():
+        result = statement.analyse(*query)
+        actual[stage + "_count"] = len(result["res_dataframe"]["Amount"])
+        actual[stage + "_total"] = result["res_total"]
+    return actual
+
+
+def check_golden(bank, rows, expected, actual):
+    for key, value in expected.items():
+        same = math.isclose(value, actual[key], rel_tol=1e-9) if isinstance(value, float) else value == actual[key]
+        assert same, f"{bank} {rows} rows: {key} is {actual[key]!r}, expected {value!r}"
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - started
+
+
+def measure(fn, *args, repeat=3):
+    # Best wall time over `repeat` runs, then one traced run for the peak Python and NumPy heap. Arrow buffers
+    # are allocated outside tracemalloc, so the growth of the Arrow pool over that run is reported alongside.
+    seconds = min(timed(fn, *args)[1] for _ in range(repeat))
+    arrow_before = pa.total_allocated_bytes()
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak, pa.total_allocated_bytes() - arrow_before
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_records(path):
+    # Latest recorded run per stage, bank and size, to compare against.
+    previous = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                record = json.loads(line)
+                previous[record["stage"], record["bank"], record["rows"]] = record
+    except FileNotFoundError:
+        pass
+    return previous
+
+
+def bench_suite(bank, rows, repeat=3, previous=None):
+    # Ingestion, dividend calculation, date range and filtering on one generated statement. Results are
+    # checked against the original implementation before any timing is reported.
+    lines = GENERATORS[bank](rows, malformed=MALFORMED)
+    statement, *ingest = measure(parse_statement, bank, lines, repeat=repeat)
+    check_golden(bank, rows, golden(bank, lines), summarise(bank, statement))
+    stages = [("ingest", len(lines), ingest)]
+    for stage, fn, args in (("dividend", statement.calculate_dividend, ()),
+                            ("date_range", statement.date_range, ()),
+                            ("analyse", statement.analyse, QUERIES[bank]["analyse"]),
+                            ("contains", statement.analyse, QUERIES[bank]["contains"])):
+        _, *timing = measure(fn, *args, repeat=repeat)
+        stages.append((stage, len(statement), timing))
+
+    records = []
+    for stage, count, (seconds, peak, arrow) in stages:
+        record = {"stage": stage, "bank": bank, "rows": rows, "seconds": seconds,
+                  "rows_per_sec": count / seconds if seconds else None, "peak_mb": peak / 1e6,
+                  "arrow_mb": arrow / 1e6}
+        line = (f"{stage:<10} {bank:<4} {rows:>9} rows  {record['rows_per_sec'] or 0:>14,.0f} rows/s  "
+                f"{seconds * 1000:9.2f} ms  peak {record['peak_mb']:8.1f} MB  arrow {record['arrow_mb']:7.1f} MB")
+        before = (previous or {}).get((stage, bank, rows))
+        if before is not None:
+            line += f"  (x{before['seconds'] / seconds:.2f} vs {before.get('revision') or before['recorded']})"
+        print(line)
+        records.append(record)
+    return records
+
+
+def bench_search(bank, rows, repeat=3):
+    # The token index is built on a statement's first 'Contains' query. This shows what it costs against the
+    # plain scan it replaces, and after how many queries on one statement it pays for itself.
+    summaries = parse_statement(bank, GENERATORS[bank](rows)).frame["summary"]
+    text = QUERIES[bank]["contains"][-1]
+    index, build, *_ = measure(SearchIndex, summaries, repeat=repeat)
+    scanned, scan, *_ = measure(index.scan, text, repeat=repeat)
+    found, search, *_ = measure(index.search, text, repeat=repeat)
+    assert (scanned == found).all()
+    saved = scan - search
+    print(f"search     {bank:<4} {rows:>9} rows  index {build * 1000:9.2f} ms  scan {scan * 1000:8.2f} ms  "
+          f"indexed {search * 1000:8.2f} ms  "
+          + (f"pays off after {math.ceil(build / saved)} queries" if saved > 0 else "never pays off"))
+
+
+def bench_analyse(rows):
+    lines = hdfc_lines(rows)
+    query = QUERIES["HDFC"]["contains"]
+    statement, load_time = timed(HDFC().load_data, lines)
+    legacy, legacy_time = timed(legacy_analyse, "HDFC", legacy_valid_lines("HDFC", lines), *query)
+    result, columnar_time = timed(statement.analyse, *query)
+    assert len(legacy['Amount']) == len(result['res_dataframe']['Amount'])
+    print(f"analyse {rows:>9} rows: loop {legacy_time:8.3f}s  columnar {columnar_time:8.3f}s "
+          f"(x{legacy_time / columnar_time:.0f})  one-off parse {load_time:.3f}s")
+
+
+def bench_sanitise(rows):
+    lines = sbi_lines(rows)
+    sanitise = SBI().sanitise
+    legacy, legacy_time = timed(lambda: [legacy_sanitise(line) for line in lines])
+    result, compiled_time = timed(lambda: [sanitise(line) for line in lines])
+    assert legacy == result
+    print(f"sanitise {rows:>8} rows: loop {legacy_time / rows * 1e6:6.2f}us/line  "
+          f"compiled {compiled_time / rows * 1e6:6.2f}us/line (x{legacy_time / compiled_time:.1f})")
+
+
+def bench_dividend(rows):
+    statement = HDFC().load_data(hdfc_lines(rows))
+    summaries = statement.frame["summary"]
+    legacy, legacy_time = timed(lambda: [legacy_is_dividend(summary) for summary in summaries])
+    mask, batch_time = timed(HDFC().dividend_mask, summaries)
+    assert legacy == mask.tolist()
+    print(f"is_dividend {rows:>5} rows: loop {legacy_time:8.3f}s  batch {batch_time:8.3f}s "
+          f"(x{legacy_time / batch_time:.1f})")
+
+
+def bench_format(rows):
+    rnd = random.Random(7)
+    amounts = [round(rnd.uniform(0, 2e9), 2) for _ in range(rows)]
+    legacy, legacy_time = timed(lambda: [legacy_format_inr(amount) for amount in amounts])
+    column = pd.Series(amounts)
+    result, batch_time = timed(format_inr, column)
+    assert [text.rsplit(".", 1)[0] for text in result] == legacy
+    print(f"format_inr  {rows:>5} rows: loop {legacy_time:8.3f}s  batch {batch_time:8.3f}s "
+          f"(x{legacy_time / batch_time:.1f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark statement parsing and analysis on generated data.")
+    parser.add_argument("sizes", nargs="*", type=int, default=SIZES, help="rows per generated statement")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per stage, the best one is reported")
+    parser.add_argument("--record", help="JSON lines file to append results to and compare against")
+    parser.add_argument("--legacy", action="store_true", help="also time the original line-by-line code")
+    args = parser.parse_args()
+
+    previous = load_records(args.record) if args.record else {}
+    recorded = datetime.now().isoformat(timespec="seconds")
+    revision = git_revision()
+    for size in args.sizes:
+        records = [record for bank in GENERATORS for record in bench_suite(bank, size, args.repeat, previous)]
+        for bank in GENERATORS:
+            bench_search(bank, size, args.repeat)
+        if args.record:
+            with open(args.record, "a") as f:
+                for record in records:
+                    f.write(json.dumps({**record, "recorded": recorded, "revision": revision}) + "\n")
+        if args.legacy:
+            bench_sanitise(size)
+            bench_analyse(size)
+            bench_dividend(size)
+            bench_format(size)
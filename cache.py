@@ -0,0 +1,100 @@
+import hashlib
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+
+from ingest import CHUNK_SIZE
+
+MAX_BYTES = int(os.environ.get("STATEMENT_CACHE_MAX_BYTES", 256 << 20))
+DISK_DIR = os.environ.get("STATEMENT_CACHE_DIR")
+
+
+def file_digest(buffer, chunk_size=CHUNK_SIZE):
+    buffer.seek(0)
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: buffer.read(chunk_size), b""):
+        digest.update(chunk)
+    buffer.seek(0)
+    return digest.hexdigest()
+
+
+def size_of(value):
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    if hasattr(value, "memory_usage"):
+        return int(value.memory_usage(deep=True).sum())
+    return sys.getsizeof(value)
+
+
+class StatementCache:
+    def __init__(self, max_bytes=MAX_BYTES, disk_dir=DISK_DIR):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.disk_dir, "-".join(str(part) for part in key) + ".pkl")
+
+    def _remember(self, key, value):
+        size = size_of(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (value, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+            self.evictions += 1
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+        if self.disk_dir and os.path.exists(self._path(key)):
+            with open(self._path(key), "rb") as f:
+                value = pickle.load(f)
+            with self._lock:
+                self.disk_hits += 1
+                self._remember(key, value)
+            return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        if self.disk_dir:
+            path = self._path(key)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(path + ".tmp", path)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+statement_cache = StatementCache()
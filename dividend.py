@@ -1,9 +1,14 @@
 import streamlit as st
 import pandas as pd
-from abc import ABC, abstractmethod
-from datetime import datetime
 
-from io import StringIO
+from banks import PARSERS, PARSER_VERSION, detect_bank, parser_timings
+from cache import file_digest, statement_cache
+from formatting import format_inr
+from ingest import find_job, head_text, job_id, submit_job
+from profiling import begin_run, instrument, profile_panel, stage
+from store import get_store
+from statement import ALL, DATE_FORMAT, merge_statements
+from tables import paged_table
 
 st.set_page_config(
     page_title='AskThatman: Calculate your dividend',
@@ -11,272 +16,165 @@ st.set_page_config(
     layout='wide',
     initial_sidebar_state='auto',
 )
+begin_run()
 
 
-def format_inr(n):
-    s = str(int(n))
-    s = s[::-1]
-    groups = []
-    i = 0
-    while i < len(s):
-        if i == 0:
-            groups.append(s[i:i+3])
-        else:
-            groups.append(s[i:i+2])
-        i += 2 if i > 0 else 3
-    return ','.join(groups)[::-1]
-
-
-class Bank(ABC):
-    @abstractmethod
-    def sanitise(self, stri):
-        pass
-
-    @abstractmethod
-    def load_data(self, string_data):
-        pass
-
-    @abstractmethod
-    def calculate_dividend(self, valid_lines):
-        pass
-
-    @abstractmethod
-    def is_dividend(self, summary):
-        pass
-
-    @abstractmethod
-    def analyse(self, valid_lines, transaction_type, threshold_amount, max_amount, from_date, to_date):
-        pass
-
-
-class HDFC(Bank):
-    def sanitise(self, stri):
-        return stri.strip()
-
-    def load_data(self, string_data):
-        res = []
-        for line in string_data:
-            if line.count(",") == 6:
-                dt, summary, vdt, debit, credit, rNumber, closingBalance = line.split(",")
-                if dt is not None and dt.count("/") == 2:
-                    res.append(line)
-        return res
-
-    def calculate_dividend(self, valid_lines):
-        res_dividend = 0
-        res_dataframe = {
-            'Date': [],
-            'Summary': [],
-            'Credit Amount': []
-        }
-        for line in valid_lines:
-            dt, summary, vdt, debit, credit, rNumber, closingBalance = line.split(",")
-            creditAmount = float(credit) if len(credit) > 0 else 0
-            if creditAmount > 0 and self.is_dividend(summary):
-                res_dividend += creditAmount
-                res_dataframe['Date'].append(dt)
-                res_dataframe['Summary'].append(summary)
-                res_dataframe['Credit Amount'].append(credit)
-        return {"res_dividend": res_dividend, "res_dataframe": res_dataframe}
-
-    def is_dividend(self, summary):
-        if summary is None or len(summary) < 3:
-            return False
-        if summary.startswith("NEFT") or summary.startswith("UPI"):
-            return False
-        if "ACH C-" in summary or " DIV " in summary:
-            return True
-        for i in range(0, 10):
-            x = " DIV" + str(i)
-            if x in summary:
-                return True
-        return False
-
-    def analyse(self, valid_lines, transaction_type, threshold_amount, max_amount, from_date, to_date, contains_text):
-        res_dataframe = {
-            'Date': [],
-            'Summary': [],
-            'Amount': []
-        }
-        for line in valid_lines:
-            dt, summary, vdt, debit, credit, rNumber, closingBalance = map(str.strip, line.split(","))
-            creditAmount = float(credit) if len(credit) > 0 else 0
-            debitAmount = float(debit) if len(debit) > 0 else 0
-            targetAmount = debitAmount if (transaction_type == "DEBIT") else creditAmount
-            target = debit if (transaction_type == "DEBIT") else credit
-
-            line_date = datetime.strptime(dt, "%d/%m/%y").date()
-
-            summary_filter_passed = True
-            if contains_text and len(contains_text.strip()) > 0:
-                summary_filter_passed = contains_text.lower() in summary.lower()
-
-            if from_date <= line_date <= to_date and targetAmount >= threshold_amount and targetAmount <= max_amount and summary_filter_passed:
-                res_dataframe['Date'].append(dt)
-                res_dataframe['Summary'].append(summary)
-                res_dataframe['Amount'].append(target)
-        return res_dataframe
-
-
-class SBI(Bank):
-    def sanitise(self, stri):
-        special_chars = ["$", "#", "@"]
-        special_one = ''
-        to_transfer_index = stri.find("TO TRANSFER")
-        transfer_to_index = stri.find("TRANSFER TO")
-        ignore_index = []
-        if to_transfer_index > -1:
-            for i in range(to_transfer_index + 1, len(stri)):
-                if stri[i] == ",":
-                    ignore_index.append(i)
-                    break
-        if transfer_to_index > -1:
-            for i in range(transfer_to_index + 1, len(stri)):
-                if stri[i] == ",":
-                    ignore_index.append(i)
-                    break
-
-        for sp in special_chars:
-            if sp not in stri:
-                special_one = sp
-                break
-        all_index = [i for i, ltr in enumerate(stri) if ltr == ","]
-        for index in all_index:
-            if index > 40 and index not in ignore_index and index + 1 < len(stri) and stri[index + 1].isdigit() and \
-                    stri[
-                        index - 1].isdigit():
-                stri = stri[: index] + special_one + stri[index + 1:]
-
-        return stri.replace(special_one, "")
-
-    def load_data(self, string_data):
-        res = []
-        for line in string_data:
-            line = self.sanitise(line)
-            if line.count(",") == 7:
-                dt, vDt, summary, ref, debit, credit, balance, nothing = line.split(",")
-                if line.startswith("Txn") == False and (len(debit) > 0 or len(credit) > 0):
-                    res.append(line)
-        return res
-
-    def calculate_dividend(self, valid_lines):
-        res_dividend = 0
-        res_dataframe = {
-            'Date': [],
-            'Summary': [],
-            'Credit Amount': []
-        }
-        for line in valid_lines:
-            dt, vDt, summary, ref, debit, credit, balance, nothing = line.split(",")
-            credit = credit.strip()
-            credit = credit.replace('"', '')
-            credit = credit.replace("'", "")
-            creditAmount = float(credit) if credit is not None and len(credit.strip()) > 0 else 0
-            if creditAmount > 0 and self.is_dividend(summary):
-                res_dividend += creditAmount
-                res_dataframe['Date'].append(dt)
-                res_dataframe['Summary'].append(summary)
-                res_dataframe['Credit Amount'].append(credit)
-        return {"res_dividend": res_dividend, "res_dataframe": res_dataframe}
-
-    def is_dividend(self, summary):
-        return "-ACHCr" in summary
-
-    def analyse(self, valid_lines, transaction_type, threshold_amount, max_amount, from_date, to_date, contains_text):
-        res_dataframe = {
-            'Date': [],
-            'Summary': [],
-            'Amount': []
-        }
-        for line in valid_lines:
-            dt, vDt, summary, ref, debit, credit, balance, nothing = map(str.strip, line.split(","))
-
-            credit = credit.replace('"', '').replace("'", "")
-            debit = debit.replace('"', '').replace("'", "")
-
-            creditAmount = float(credit) if len(credit) > 0 else 0
-            debitAmount = float(debit) if len(debit) > 0 else 0
-
-            targetAmount = debitAmount if (transaction_type == "DEBIT") else creditAmount
-            target = debit if (transaction_type == "DEBIT") else credit
-            
-            line_date = datetime.strptime(dt, "%d/%m/%y").date()
-
-            summary_filter_passed = True
-            if contains_text and len(contains_text.strip()) > 0:
-                summary_filter_passed = contains_text.lower() in summary.lower()
-
-            if from_date <= line_date <= to_date and targetAmount >= threshold_amount and targetAmount <= max_amount and summary_filter_passed:
-                res_dataframe['Date'].append(dt)
-                res_dataframe['Summary'].append(summary)
-                res_dataframe['Amount'].append(target)
-        return res_dataframe
-
-
-sbi_processor = SBI()
-hdfc_processor = HDFC()
-
-
-def get_processor(bank):
-    if bank == "HDFC":
-        return hdfc_processor
-    elif bank == "SBI":
-        return sbi_processor
-    else:
-        raise Exception("Invalid Bank Provided")
+AUTO_DETECT = 'Auto-detect'
 
 
-def load_statement(string_data, bank):
-    return get_processor(bank).load_data(string_data)
+@st.cache_resource
+def transaction_store():
+    return get_store()
 
 
-def calculate_dividend(valid_lines, bank):
+@instrument("calculate_dividend", rows_in=lambda statement, *args: len(statement),
+            rows_out=lambda result: len(result["res_dataframe"]["Date"]))
+def calculate_dividend(statement, fy, payer):
     try:
-        return get_processor(bank).calculate_dividend(valid_lines)
+        return statement.calculate_dividend(fy, payer)
     except:
         st.session_state["processing_error"] = "Error while calculating dividend. Please try again later"
         st.session_state["processing_success"] = False
 
 
-def analyse_statement(valid_lines, bank, transaction_type, threshold_amount, max_amount, from_date, to_date, contains_text):
+@instrument("analyse_statement", rows_in=lambda statement, *args: len(statement),
+            rows_out=lambda result: len(result["res_dataframe"]["Amount"]))
+def analyse_statement(statement, transaction_type, threshold_amount, max_amount, from_date, to_date, contains_text):
     try:
-        return get_processor(bank).analyse(valid_lines, transaction_type, threshold_amount, max_amount, from_date, to_date, contains_text)
+        if st.session_state.get("history_account") is not None:
+            return transaction_store().query(st.session_state["history_account"], transaction_type,
+                                             threshold_amount, max_amount, from_date, to_date, contains_text)
+        return statement.analyse(transaction_type, threshold_amount, max_amount, from_date, to_date, contains_text)
     except:
         st.session_state["processing_error"] = "Error while analysing statement. Please try again later"
         st.session_state["processing_success"] = False
 
 
-def process_statement_file(uploaded_file, bank):
+def reset_views():
+    # The kept analysis query and table pages belong to the statement on screen, not to the next one.
+    for key in ("analysis", "analysis_page", "dividend_page"):
+        st.session_state.pop(key, None)
+
+
+def upload_key(uploaded_files, bank, account):
+    return tuple(uploaded_file.file_id for uploaded_file in uploaded_files), bank, account
+
+
+@instrument("process_statement_files")
+def process_statement_files(uploaded_files, bank, account=None):
+    # Files are parsed by background jobs keyed by bank and content hash, so reruns while they run neither
+    # restart nor duplicate them. Until every job is done, the rows parsed so far are shown as a partial result.
     try:
-        stringio = StringIO(uploaded_file.getvalue().decode("utf-8"))
-        all = stringio.getvalue().split("\n")
-        with st.spinner(text="Ingesting Statement..."):
-            st.session_state["valid_lines"] = load_statement(all, bank)
-            st.session_state['bank'] = bank
-            st.session_state["processing_error"] = None
-            st.session_state["processing_success"] = True
+        files_key = upload_key(uploaded_files, bank, account)
+        if st.session_state.get("statement_files") == files_key:
+            return
+        if st.session_state.get("shown_files") != files_key:
+            reset_views()
+            st.session_state["shown_files"] = files_key
+        statements = []
+        running = []
+        # Failed jobs leave the registry, so the session's own references are what report their errors.
+        previous = {job.id: job for job in st.session_state.get("ingest_jobs", [])}
+        # Each upload is hashed once, not on every rerun while its job runs.
+        digests = {uploaded_file.file_id: st.session_state.get("file_digests", {}).get(uploaded_file.file_id)
+                   or file_digest(uploaded_file) for uploaded_file in uploaded_files}
+        st.session_state["file_digests"] = digests
+        for uploaded_file in uploaded_files:
+            file_bank = detect_bank(head_text(uploaded_file)) if bank == AUTO_DETECT else bank
+            if file_bank is None:
+                st.session_state["processing_error"] = f"Could not recognise the bank for {uploaded_file.name}. " \
+                                                       "Please choose the bank and try again."
+                st.session_state["processing_success"] = False
+                st.session_state["ingest_jobs"] = []
+                return
+            key = (file_bank, digests[uploaded_file.file_id], PARSER_VERSION)
+            job = find_job(job_id(key)) or previous.get(job_id(key))
+            statement = job.statement if job is not None else statement_cache.get(key)
+            if statement is None:
+                job = job or submit_job(key, file_bank, uploaded_file, on_done=statement_cache.put)
+                if job.error is not None:
+                    raise job.error
+                running.append(job)
+                statement = job.partial()
+            statements.append(statement)
+
+        statements = [statement for statement in statements if statement is not None]
+        st.session_state["ingest_jobs"] = running
+        st.session_state["ingest_seen"] = ingest_snapshot(running)
+        st.session_state["history_account"] = None
+        merged = st.session_state.get("merged_statements")
+        if merged is not None and len(merged[0]) == len(statements) and all(
+                statement is part for statement, part in zip(statements, merged[0])):
+            st.session_state["statement"] = merged[1]
+        elif statements:
+            with stage("merge_statements", rows_in=lambda: sum(len(statement) for statement in statements)) as timing:
+                st.session_state["statement"] = statements[0] if len(statements) == 1 else merge_statements(statements)
+                timing.rows_out = len(st.session_state["statement"])
+        else:
+            st.session_state["statement"] = None
+        # Partials only change every few pieces, so the merge of unchanged parts is reused.
+        st.session_state["merged_statements"] = (statements, st.session_state["statement"])
+        st.session_state["processing_error"] = None
+        if running:
+            st.session_state["processing_success"] = False
+            return
+
+        st.session_state["statement_files"] = files_key
+        if account:
+            with stage("store_append", rows_in=len(st.session_state["statement"])) as timing:
+                st.session_state["saved_rows"] = transaction_store().append(account, st.session_state["statement"].frame)
+                timing.rows_out = st.session_state["saved_rows"]
+        st.session_state["processing_success"] = True
     except:
         st.session_state["processing_error"] = "Error while processing file. Please make sure you are uploading " \
                                                "correct csv file. We currently support only HDFC and SBI bank's " \
                                                "statements for calculating dividend. "
         st.session_state["processing_success"] = False
+        st.session_state["ingest_jobs"] = []
+
+
+def ingest_snapshot(jobs):
+    return tuple((job.partial_step, job.finished) for job in jobs)
+
+
+@st.fragment(run_every=1)
+def ingest_progress():
+    # Polls the running jobs without rerunning the page, and reruns it once more of the statement is parsed.
+    jobs = st.session_state.get("ingest_jobs", [])
+    size = max(sum(job.size for job in jobs), 1)
+    st.progress(sum(job.parsed for job in jobs) / size, text=f"Ingesting Statements... {sum(job.rows for job in jobs)} rows parsed")
+    if ingest_snapshot(jobs) != st.session_state.get("ingest_seen"):
+        st.rerun()
 
 
 with st.sidebar:
     st.markdown('## Share your Bank Statement')
     bank = st.selectbox(
-        'Choose your Bank?', ('Select Here', 'HDFC', 'SBI'))
-    st.write("Please choose your bank before uploading the statement")
-    uploaded_file = st.file_uploader("Choose file for bank statement", type=["csv", "DELIMITED"])
-    if uploaded_file is not None:
-        if bank == 'Select Here':
-            st.session_state["processing_error"] = "Bank not selected. Please select bank first and try again."
-            st.session_state["processing_success"] = False
-            uploaded_file = None
-        else:
-            process_statement_file(uploaded_file, bank)
-            if st.session_state.get("processing_error") is None:
-                st.write("Statement Successfully Processed")
+        'Choose your Bank?', (AUTO_DETECT, *PARSERS))
+    st.write("The bank is detected from each statement unless you choose one")
+    uploaded_files = st.file_uploader("Choose files for bank statements", type=["csv", "DELIMITED"],
+                                      accept_multiple_files=True)
+    account = None
+    if transaction_store() is not None:
+        account = st.text_input("Account name", "My account",
+                                help="Processed statements are added to this account's saved history")
+    if uploaded_files:
+        process_statement_files(uploaded_files, bank, account)
+        if st.session_state.get("ingest_jobs"):
+            ingest_progress()
+        elif st.session_state.get("processing_error") is None:
+            st.write(f"{len(uploaded_files)} Statement(s) Successfully Processed")
+            if account:
+                st.write(f"{st.session_state.get('saved_rows', 0)} new transactions saved to history")
+    if account and st.button("Load saved history"):
+        # The current uploads count as handled, so history stays on screen until the files change.
+        reset_views()
+        st.session_state["statement"] = transaction_store().load(account)
+        st.session_state["history_account"] = account
+        st.session_state["statement_files"] = upload_key(uploaded_files or [], bank, account)
+        st.session_state["ingest_jobs"] = []
+        st.session_state["processing_error"] = None
+        st.session_state["processing_success"] = True
 
 
 st.title('Calculate your dividend')
@@ -284,44 +182,51 @@ st.write(
     "This is a simple utility to calculate the total dividend you received from your stock investments. Just upload your bank statement in CSV format in the left panel. We currently support only HDFC and SBI bank's statements.")
 if st.session_state.get("processing_error") is not None:
     st.error(st.session_state.get("processing_error"), icon="🚨")
+if st.session_state.get("ingest_jobs"):
+    st.info("Statements are still being ingested. Results below cover the transactions parsed so far.", icon="⏳")
 if st.session_state.get("processing_success"):
     st.success(
-        "Statement processed successfully. Please click on calculate to find your dividend for this financial year",
+        "Statement processed successfully. Please click on calculate to find your dividend for each financial year",
         icon="✅")
 
 if st.button('Calculate Dividend', key='button2'):
-    with st.spinner(text="Calculating"):
-        valid_lines = st.session_state.get("valid_lines")
-        if valid_lines is not None:
-            result = calculate_dividend(valid_lines, st.session_state.get("bank"))
-            st.write("Your dividend for this financial year is: " + str(result["res_dividend"]) + " INR")
-            df = pd.DataFrame(result["res_dataframe"])
-            st.table(df)
-        else:
-            st.write("Please load bank statement first from left panel.")
+    st.session_state["show_dividend"] = True
+
+if st.session_state.get("show_dividend"):
+    statement = st.session_state.get("statement")
+    if statement is not None:
+        col1, col2 = st.columns(2)
+        with col1:
+            fy = st.selectbox("Financial year", (*statement.financial_years(), ALL))
+        with col2:
+            payers = statement.payers(fy) if fy != ALL else None
+            payer = st.selectbox("Paid by", (ALL, *(payers.index if payers is not None else [])))
+        result = calculate_dividend(statement, fy, payer)
+        period = "for " + fy if fy != ALL else "across all statements"
+        st.write(f"Your dividend {period} is: {format_inr(result['res_dividend'])} INR")
+        if payers is not None and payer == ALL:
+            col3, col4 = st.columns(2)
+            with col3:
+                st.table(payers.assign(Total=format_inr(payers["Total"])))
+            with col4:
+                quarters = statement.quarters(fy)
+                st.table(quarters.assign(Total=format_inr(quarters["Total"])))
+        df = pd.DataFrame(result["res_dataframe"])
+        paged_table(df, "dividend", date_format=DATE_FORMAT, amount_columns=["Credit Amount"])
+    else:
+        st.write("Please load bank statement first from left panel.")
 
 
-def get_date_range(valid_lines, bank):
-    if not valid_lines:
-        return None, None
-    dates = []
-    for line in valid_lines:
-        try:
-            date_str = line.split(",")[0].strip()
-            dates.append(datetime.strptime(date_str, "%d/%m/%y").date())
-        except (ValueError, IndexError):
-            continue
-    if not dates:
-        return None, None
-    return min(dates), max(dates)
+def get_date_range(statement):
+    return statement.date_range()
 
 
-if st.session_state.get("valid_lines") is not None:
+if st.session_state.get("statement") is not None:
     with st.spinner(text="Analysing"):
-        valid_lines = st.session_state.get("valid_lines")
+        statement = st.session_state.get("statement")
         st.header('Detailed statement analysis', divider='rainbow')
 
-        min_date, max_date = get_date_range(valid_lines, st.session_state.get("bank"))
+        min_date, max_date = get_date_range(statement)
 
         col1, col2, col3 = st.columns(3)
         with col1:
@@ -347,15 +252,21 @@ if st.session_state.get("valid_lines") is not None:
             with col6:
                 contains_text = st.text_input("Contains (optional)", "", placeholder="Filter by text in summary (case-insensitive)")
 
-        
+
         if st.button("Analyse", type="primary", key="button3"):
             if threshold_amount >= max_amount:
                 st.error("Max amount should be greater than threshold amount")
+                st.session_state.pop("analysis", None)
             else:
-                result_data = analyse_statement(valid_lines, st.session_state.get("bank"), transaction_type,
-                                                    threshold_amount, max_amount, from_date, to_date, contains_text)
-                df2 = pd.DataFrame(result_data)
-                st.table(df2)
+                st.session_state["analysis"] = (transaction_type, threshold_amount, max_amount, from_date, to_date,
+                                                contains_text)
+
+        if st.session_state.get("analysis") is not None:
+            result_data = analyse_statement(statement, *st.session_state["analysis"])
+            if result_data is not None:
+                df2 = pd.DataFrame(result_data["res_dataframe"])
+                paged_table(df2, "analysis", date_format=DATE_FORMAT, amount_columns=["Amount"])
                 if not df2.empty:
-                    total_amount = pd.to_numeric(df2['Amount']).sum()
-                    st.subheader(f"Total Amount: :blue[₹ {format_inr(total_amount)}]")
+                    st.subheader(f"Total Amount: :blue[₹ {format_inr(result_data['res_total'])}]")
+
+profile_panel({"Statement cache": statement_cache.stats(), "Parser timings": parser_timings()})
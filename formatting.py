@@ -0,0 +1,38 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+
+def _digits(values, width=None, padded=None):
+    # Decimal text of integers, zero padded to `width` where `padded` is set (everywhere when it is None).
+    text = pc.cast(pa.array(values), pa.string())
+    if width is None:
+        return text
+    filled = pc.utf8_lpad(text, width, "0")
+    return filled if padded is None else pc.if_else(pa.array(padded), filled, text)
+
+
+def format_inr(amounts):
+    # Indian digit grouping (12,34,567.89) for a rupee amount or a whole column of them at once, built with
+    # Arrow string kernels. Amounts are rounded to paise, negatives keep their sign and missing values are blank.
+    values = np.atleast_1d(np.asarray(amounts, dtype="float64"))
+    missing = np.isnan(values)
+    paise = np.round(np.where(missing, 0, values) * 100).astype(np.int64)
+    rupees, fraction = np.divmod(np.abs(paise), 100)
+
+    rest, last = np.divmod(rupees, 1000)
+    text = _digits(last, 3, rest > 0)
+    while (rest > 0).any():
+        grouped = pa.array(rest > 0)
+        rest, group = np.divmod(rest, 100)
+        text = pc.if_else(grouped, pc.binary_join_element_wise(_digits(group, 2, rest > 0), text, ","), text)
+
+    text = pc.binary_join_element_wise(text, _digits(fraction, 2), ".")
+    text = pc.if_else(pa.array(paise < 0), pc.binary_join_element_wise("-", text, ""), text)
+    text = pc.if_else(pa.array(missing), "", text)
+    if isinstance(amounts, pd.Series):
+        return pd.Series(pd.arrays.ArrowStringArray(text), index=amounts.index, name=amounts.name)
+    if np.ndim(amounts) == 0:
+        return text[0].as_py()
+    return text.to_numpy(zero_copy_only=False)
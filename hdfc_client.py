@@ -0,0 +1,123 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = os.environ.get("HDFC_API_URL", "https://rosymindmap.azurewebsites.net/api/hdfc/transactions")
+VERIFY_TLS = os.environ.get("HDFC_API_VERIFY", "false").lower() == "true"
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 60
+CACHE_TTL = 300
+# Responses of at most this many user and statement date pairs are kept, least recently used first out.
+CACHE_ENTRIES = 256
+
+
+class FetchError(Exception):
+    def __init__(self, status_code, message, text=""):
+        super().__init__(message)
+        self.status_code = status_code
+        self.text = text
+
+
+class TransactionClient:
+    # One pooled session shared by every Streamlit session. Successful responses are cached per user and
+    # statement date, keyed by a hash of the credentials so secrets are never kept as cache keys.
+    def __init__(self, api_url=API_URL, verify=VERIFY_TLS, ttl=CACHE_TTL, max_entries=CACHE_ENTRIES, retries=3,
+                 backoff=0.5, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)):
+        self.api_url = api_url
+        self.verify = verify
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.session = requests.Session()
+        # Read timeouts are raised as they are rather than retried: the request already waited READ_TIMEOUT,
+        # and each retry would make the click wait that long again.
+        retry = Retry(total=retries, read=False, backoff_factor=backoff, status_forcelist=(429, 502, 503, 504),
+                      allowed_methods=frozenset({"POST"}), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=retry)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.requests = 0
+        self.fetch_seconds = 0.0
+        self.last_fetch_seconds = None
+
+    def _key(self, email, secret, statement_date):
+        identity = hashlib.sha256(f"{email}\0{secret}".encode("utf-8")).hexdigest()
+        return identity, statement_date
+
+    def _cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self._cache.pop(key, None)
+            self.misses += 1
+            return None
+
+    def _remember(self, key, statements):
+        # Expired entries of every user are dropped on each insert, so the cache never holds more than the
+        # responses of the last TTL, capped at max_entries.
+        with self._lock:
+            now = time.monotonic()
+            for expired in [cached for cached, (expires, _) in self._cache.items() if expires <= now]:
+                del self._cache[expired]
+            self._cache[key] = (now + self.ttl, statements)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def fetch(self, email, secret, statement_date=None):
+        # Returns the list of statements. With statement_date only that statement is requested, and the
+        # response is narrowed to it in case the API sends back every statement anyway.
+        key = self._key(email, secret, statement_date)
+        statements = self._cached(key)
+        if statements is not None:
+            return statements
+
+        payload = {"userEmail": email, "secret": secret}
+        if statement_date is not None:
+            payload["statementDate"] = statement_date
+        started = time.perf_counter()
+        try:
+            response = self.session.post(self.api_url, json=payload, verify=self.verify, timeout=self.timeout)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.requests += 1
+                self.fetch_seconds += elapsed
+                self.last_fetch_seconds = elapsed
+
+        if response.status_code != 200:
+            raise FetchError(response.status_code, f"Status code: {response.status_code}", response.text)
+        data = response.json()
+        if not (data.get("success") and data.get("data")):
+            raise FetchError(response.status_code, data.get('message', 'An unknown error occurred.'))
+        statements = data["data"]
+        if statement_date is not None:
+            statements = [item for item in statements if item.get("statementDate") == statement_date]
+        self._remember(key, statements)
+        return statements
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "requests": self.requests,
+                "cache_hits": self.hits,
+                "cache_misses": self.misses,
+                "cache_hit_rate": self.hits / lookups if lookups else 0.0,
+                "cache_entries": len(self._cache),
+                "avg_fetch_seconds": self.fetch_seconds / self.requests if self.requests else 0.0,
+                "last_fetch_seconds": self.last_fetch_seconds,
+            }
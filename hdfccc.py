@@ -1,7 +1,18 @@
+import re
+
 import streamlit as st
 import requests
+import numpy as np
 import pandas as pd
 
+from formatting import format_inr
+from hdfc_client import FetchError, TransactionClient
+from profiling import begin_run, profile_panel, stage
+from search import SearchIndex
+from statement import DATE_FORMAT, to_paise, to_rupees
+from store import card_transactions, get_store
+from tables import paged_table
+
 requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
 
 st.set_page_config(
@@ -10,19 +21,69 @@ st.set_page_config(
     layout='wide',
     initial_sidebar_state='auto',
 )
+begin_run()
+
+DEFAULT_KEYWORDS = "zomato, swiggy, zepto, blinkit, amazon, myntra"
+
+
+def spend_by_keyword(df, keywords):
+    # Labels each transaction with the first keyword found in its description in a single regex pass and
+    # totals signed amounts per label in paise, so the cost does not grow with the number of keywords.
+    if not keywords:
+        return []
+    paise = to_paise(df['amount']).fillna(0)
+    signed = paise.where(df['transactionType'] == 'DEBIT', -paise)
+    pattern = "(" + "|".join(re.escape(keyword) for keyword in sorted(keywords, key=len, reverse=True)) + ")"
+    labels = df['description'].str.extract(pattern, flags=re.IGNORECASE, expand=False).str.lower()
+    totals = signed.groupby(labels).sum()
+    return [(keyword, to_rupees(int(totals.get(keyword.lower(), 0)))) for keyword in keywords]
+
+
+def transaction_count(raw_data):
+    return sum(len(item.get('transactions') or []) for item in raw_data)
+
+
+def index_statements(raw_data):
+    # Normalizes every fetched statement once: typed frame, amounts in paise for exact totals and precomputed amount
+    # orderings, so switching, filtering and sorting never rebuild the frame. The search index over descriptions is
+    # left to statement_search.
+    statements = {}
+    for item in raw_data:
+        transactions = item.get('transactions')
+        entry = {'totalRewards': item.get('totalRewards'), 'df': None}
+        if transactions:
+            df = pd.DataFrame(transactions)
+            df['amount'] = pd.to_numeric(df['amount'])
+            positions = np.arange(len(df))
+            entry['df'] = df
+            entry['paise'] = to_paise(df['amount']).fillna(0).to_numpy(dtype=np.int64)
+            entry['debit'] = (df['transactionType'] == 'DEBIT').to_numpy()
+            entry['credit'] = (df['transactionType'] == 'CREDIT').to_numpy()
+            entry['order'] = {
+                "Default": positions,
+                "Low to High": np.argsort(df['amount'].to_numpy(), kind="stable"),
+                "High to Low": np.argsort(-df['amount'].to_numpy(), kind="stable"),
+            }
+        statements[item['statementDate']] = entry
+    return statements
+
+
+def statement_search(entry):
+    # Built on the first description filter of a statement, since most statements are never filtered.
+    if 'search' not in entry:
+        entry['search'] = SearchIndex(entry['df']['description'])
+    return entry['search']
+
+
+@st.cache_resource
+def get_client():
+    return TransactionClient()
+
+
+@st.cache_resource
+def transaction_store():
+    return get_store()
 
-def format_inr(n):
-    s = str(int(n))
-    s = s[::-1]
-    groups = []
-    i = 0
-    while i < len(s):
-        if i == 0:
-            groups.append(s[i:i+3])
-        else:
-            groups.append(s[i:i+2])
-        i += 2 if i > 0 else 3
-    return ','.join(groups)[::-1]
 
 with st.sidebar:
     st.markdown('## Get HDFC Credit Card Transactions')
@@ -36,49 +97,61 @@ st.title("HDFC Credit Card Transactions Viewer")
 if fetch_button:
     if 'raw_data' in st.session_state:
         del st.session_state.raw_data
+    st.session_state.pop('statements', None)
     if not email or not secret:
         st.error("Please provide both email and secret.")
     else:
         with st.spinner("Fetching transactions..."):
             try:
-                api_url = "https://rosymindmap.azurewebsites.net/api/hdfc/transactions"
-                payload = {
-                    "userEmail": email,
-                    "secret": secret
-                }
-                response = requests.post(api_url, json=payload, verify=False)
-
-                if response.status_code == 200:
-                    data = response.json()
-                    if data.get("success") and data.get("data"):
-                        st.session_state.raw_data = data["data"]
-                    else:
-                        st.error(f"API Error: {data.get('message', 'An unknown error occurred.')}")
-
-                elif response.status_code == 401:
+                with stage("fetch") as timing:
+                    st.session_state.raw_data = get_client().fetch(email, secret)
+                    timing.rows_out = lambda: transaction_count(st.session_state.raw_data)
+                with stage("index_statements", rows_in=lambda: transaction_count(st.session_state.raw_data)) as timing:
+                    st.session_state.statements = index_statements(st.session_state.raw_data)
+                    timing.rows_out = lambda: sum(len(entry['df']) for entry in st.session_state.statements.values()
+                                                  if entry['df'] is not None)
+                if transaction_store() is not None:
+                    with stage("store_append") as timing:
+                        st.session_state.saved_rows = sum(
+                            transaction_store().append(f"HDFC CC {email}", card_transactions(statement_date, entry['df']))
+                            for statement_date, entry in st.session_state.statements.items() if entry['df'] is not None)
+                        timing.rows_out = st.session_state.saved_rows
+
+            except FetchError as e:
+                if e.status_code == 401:
                     st.error("Unauthorized: The secret provided is incorrect.")
-                
+                elif e.status_code == 200:
+                    st.error(f"API Error: {e}")
                 else:
-                    st.error(f"Error fetching transactions. Status code: {response.status_code}")
-                    st.text(response.text)
+                    st.error(f"Error fetching transactions. Status code: {e.status_code}")
+                    st.text(e.text)
 
             except requests.exceptions.ConnectionError as e:
                 st.error("Connection Error: Could not connect to the API.")
                 st.error(f"Underlying error: {e}")
+            except requests.exceptions.Timeout:
+                st.error("Timeout: The API took too long to respond. Please try again.")
             except Exception as e:
                 st.error(f"An unexpected error occurred: {e}")
 
+with st.sidebar:
+    if 'saved_rows' in st.session_state:
+        st.caption(f"{st.session_state.saved_rows} new transactions saved to history")
+    if transaction_store() is not None and email and st.button("Load saved history"):
+        st.session_state.card_history = f"HDFC CC {email}"
+
 if 'raw_data' in st.session_state:
     st.success("Transactions fetched successfully!")
     
-    statement_dates = [item['statementDate'] for item in st.session_state.raw_data]
-    selected_date = st.selectbox("Select Statement Date", statement_dates)
+    if 'statements' not in st.session_state:
+        st.session_state.statements = index_statements(st.session_state.raw_data)
+    statements = st.session_state.statements
+    selected_date = st.selectbox("Select Statement Date", list(statements))
 
-    selected_statement_data = next((item for item in st.session_state.raw_data if item['statementDate'] == selected_date), None)
+    selected_statement_data = statements.get(selected_date)
 
-    if selected_statement_data and selected_statement_data.get('transactions'):
-        df = pd.DataFrame(selected_statement_data['transactions'])
-        df['amount'] = pd.to_numeric(df['amount'])
+    if selected_statement_data and selected_statement_data['df'] is not None:
+        df = selected_statement_data['df']
 
         col1, col2 = st.columns(2)
         with col1:
@@ -86,22 +159,21 @@ if 'raw_data' in st.session_state:
         with col2:
             sort_order = st.selectbox("Sort by amount", ("Default", "Low to High", "High to Low"), key=f"sort_{selected_date}")
 
+        with stage("filter", rows_in=len(df)) as timing:
+            rows = selected_statement_data['order'][sort_order]
+            if contains_text:
+                matches = np.zeros(len(df), dtype=bool)
+                matches[statement_search(selected_statement_data).search(contains_text)] = True
+                rows = rows[matches[rows]]
+            filtered_df = df if len(rows) == len(df) and sort_order == "Default" else df.take(rows)
+            timing.rows_out = len(filtered_df)
 
-        if contains_text:
-            filtered_df = df[df['description'].str.contains(contains_text, case=False, na=False)].copy()
-        else:
-            filtered_df = df.copy()
-        
-        if sort_order == "Low to High":
-            filtered_df = filtered_df.sort_values(by='amount', ascending=True)
-        elif sort_order == "High to Low":
-            filtered_df = filtered_df.sort_values(by='amount', ascending=False)
-
-        st.table(filtered_df)
+        paged_table(filtered_df, f"transactions_{selected_date}", sortable=False, amount_columns=["amount"])
 
         if not filtered_df.empty:
-            debit_total = filtered_df[filtered_df['transactionType'] == 'DEBIT']['amount'].sum()
-            credit_total = filtered_df[filtered_df['transactionType'] == 'CREDIT']['amount'].sum()
+            paise = selected_statement_data['paise'][rows]
+            debit_total = to_rupees(int(paise[selected_statement_data['debit'][rows]].sum()))
+            credit_total = to_rupees(int(paise[selected_statement_data['credit'][rows]].sum()))
 
             col1, col2 = st.columns(2)
             with col1:
@@ -116,29 +188,63 @@ if 'raw_data' in st.session_state:
 
             st.header("Spending by Keyword", divider="rainbow")
             
-            keywords = ['zomato', 'swiggy', 'zepto', 'blinkit','amazon', 'myntra']
+            keywords = [keyword.strip() for keyword in st.text_input(
+                "Keywords (comma separated)", DEFAULT_KEYWORDS, key="keywords").split(",") if keyword.strip()]
             summary_data = []
 
             # Include both DEBIT and CREDIT transactions for keyword analysis
             # DEBIT transactions are positive amounts, CREDIT transactions (refunds) are negative amounts
-            keyword_df = filtered_df.copy()
-            keyword_df['amount'] = keyword_df.apply(
-                lambda row: row['amount'] if row['transactionType'] == 'DEBIT' else -row['amount'], 
-                axis=1
-            )
-
-            for keyword in keywords:
-                mask = keyword_df['description'].str.contains(keyword, case=False, na=False)
-                total = keyword_df[mask]['amount'].sum()
+            with stage("spend_by_keyword", rows_in=len(filtered_df)):
+                spend = spend_by_keyword(filtered_df, keywords)
+            for keyword, total in spend:
                 if total != 0:  # Changed from > 0 to != 0 to include refunds
                     summary_data.append({'Keyword': keyword.capitalize(), 'Total Spent': total})
-            
+
             if summary_data:
                 summary_df = pd.DataFrame(summary_data)
-                summary_df['Total Spent'] = summary_df['Total Spent'].apply(lambda x: f"₹ {format_inr(x)}")
+                summary_df['Total Spent'] = "₹ " + format_inr(summary_df['Total Spent'])
                 st.table(summary_df)
 
         elif contains_text:
             st.info("No transactions match your filter.")
     else:
         st.info(f"No transactions found for statement date {selected_date}.")
+
+if st.session_state.get('card_history') is not None:
+    account = st.session_state.card_history
+    st.header(f"Saved history: {account}", divider="rainbow")
+    min_date, max_date = transaction_store().date_range(account)
+    if min_date is None:
+        st.info("No saved transactions yet. Fetched statements are added to the history.")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            transaction_type = st.selectbox("Transaction type", ("DEBIT", "CREDIT"), key="history_type")
+        with col2:
+            min_amount = st.number_input("Minimum amount", value=1, step=100, key="history_min")
+        with col3:
+            max_amount = st.number_input("Max amount", value=100000, step=500, key="history_max")
+        col4, col5, col6 = st.columns(3)
+        with col4:
+            from_date = st.date_input("From Date", value=min_date, min_value=min_date, max_value=max_date,
+                                      key="history_from")
+        with col5:
+            to_date = st.date_input("To Date", value=max_date, min_value=min_date, max_value=max_date,
+                                    key="history_to")
+        with col6:
+            history_text = st.text_input("Contains (optional)", "", placeholder="e.g., swiggy, amazon",
+                                         key="history_text")
+
+        if min_amount >= max_amount:
+            st.error("Max amount should be greater than minimum amount")
+        else:
+            with stage("history_query") as timing:
+                result = transaction_store().query(account, transaction_type, min_amount, max_amount, from_date,
+                                                   to_date, history_text)
+                history_df = pd.DataFrame(result["res_dataframe"])
+                timing.rows_out = len(history_df)
+            paged_table(history_df, "history", date_format=DATE_FORMAT, amount_columns=["Amount"])
+            if not history_df.empty:
+                st.subheader(f"Total Amount: :blue[₹ {format_inr(result['res_total'])}]")
+
+profile_panel({"API client": get_client().stats()})
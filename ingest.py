@@ -0,0 +1,210 @@
+import codecs
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from banks import get_bank, record_timing
+from statement import Statement, concat_frames
+
+CHUNK_SIZE = 1 << 20
+SNIFF_SIZE = 4096
+# Uploads are parsed in pieces of about this size, split at line ends, so big files use every worker and
+# report progress as pieces finish.
+JOB_CHUNK_SIZE = 4 << 20
+WORKERS = os.cpu_count() or 1
+# Pieces are read from the upload only as workers free up, so at most this many copies are in flight per job.
+IN_FLIGHT = 2 * WORKERS
+# The page reruns, and partial statements are rebuilt, once per this many finished pieces rather than per piece.
+PARTIAL_PIECES = 4
+# Finished jobs are kept this long so every session polling them can pick up the result.
+JOB_TTL = 600
+
+_executor = None
+_executor_lock = threading.Lock()
+_runner = None
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def iter_lines(buffer, chunk_size=CHUNK_SIZE, encoding="utf-8"):
+    # Decodes the upload chunk by chunk so only one chunk plus a partial line is held at a time.
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ""
+    while True:
+        chunk = buffer.read(chunk_size)
+        if not chunk:
+            break
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        yield from lines
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending
+
+
+def head_text(buffer, size=SNIFF_SIZE):
+    buffer.seek(0)
+    head = buffer.read(size).decode("utf-8", errors="ignore")
+    buffer.seek(0)
+    return head
+
+
+def read_pieces(buffer, chunk_size=JOB_CHUNK_SIZE):
+    # Pieces of about chunk_size bytes, each extended to the end of its last line.
+    while True:
+        piece = buffer.read(chunk_size)
+        if not piece:
+            return
+        yield piece + buffer.readline()
+
+
+def parse_chunk(bank, data):
+    started = time.perf_counter()
+    frame = get_bank(bank).load_frame(iter_lines(io.BytesIO(data)))
+    return frame, time.perf_counter() - started
+
+
+def executor():
+    # Spawned rather than forked, since the Streamlit server is multi-threaded. Kept warm across reruns.
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _executor
+
+
+def discard_executor(pool):
+    # A worker that dies, e.g. killed for memory, breaks the whole pool. The next job starts a fresh one.
+    global _executor
+    with _executor_lock:
+        if _executor is pool:
+            _executor = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def runner():
+    # Threads that hand chunks to the process pool and assemble the results, off the script thread.
+    global _runner
+    if _runner is None:
+        _runner = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ingest")
+    return _runner
+
+
+def job_id(key):
+    return "-".join(str(part) for part in key)
+
+
+class IngestJob:
+    # Background parse of one upload, identified by its cache key so the same file is never parsed twice at once.
+    # Chunks are parsed in the process pool; the ones finished so far can be read as a partial statement.
+    def __init__(self, key, bank, source, on_done=None):
+        self.id = job_id(key)
+        self.key = key
+        self.bank = bank
+        self.on_done = on_done
+        # A reader of its own over the upload's bytes, which BytesIO shares rather than copies, so the script
+        # thread can keep seeking the upload while pieces are read here.
+        self.reader = io.BytesIO(source.getvalue())
+        self.size = self.reader.seek(0, io.SEEK_END)
+        self.reader.seek(0)
+        self.frames = {}
+        self.done = 0
+        self.parsed = 0
+        self.rows = 0
+        self.statement = None
+        self.error = None
+        self.finished_at = None
+        self._partial = (0, None)
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.finished_at is not None
+
+    @property
+    def partial_step(self):
+        return self.done // PARTIAL_PIECES
+
+    def _collect(self, pending, return_when):
+        finished, _ = wait(pending, return_when=return_when)
+        for future in finished:
+            index, size = pending.pop(future)
+            frame, seconds = future.result()
+            record_timing(self.bank, "parse", seconds, len(frame))
+            with self._lock:
+                self.frames[index] = frame
+                self.done += 1
+                self.parsed += size
+                self.rows += len(frame)
+
+    def run(self):
+        pool = executor()
+        try:
+            pending = {}
+            for index, piece in enumerate(read_pieces(self.reader)):
+                pending[pool.submit(parse_chunk, self.bank, piece)] = index, len(piece)
+                if len(pending) >= IN_FLIGHT:
+                    self._collect(pending, FIRST_COMPLETED)
+            while pending:
+                self._collect(pending, FIRST_COMPLETED)
+            frames = [self.frames[index] for index in sorted(self.frames)]
+            statement = Statement(concat_frames(frames)) if frames else get_bank(self.bank).load_data([])
+            # Rollups are built here, off the script thread. The search index stays lazy until a 'Contains' query.
+            statement.rollups
+            if self.on_done is not None:
+                self.on_done(self.key, statement)
+            self.statement = statement
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                discard_executor(pool)
+            self.error = e
+            # Failures are not kept, so the next attempt at this upload starts a new job.
+            forget_job(self)
+        finally:
+            self.reader = None
+            self.frames = None
+            self.finished_at = time.monotonic()
+            if self.error is None:
+                # Dropped after JOB_TTL even if no session looks again, so an idle server lets go of the statement.
+                expiry = threading.Timer(JOB_TTL, forget_job, (self,))
+                expiry.daemon = True
+                expiry.start()
+
+    def partial(self):
+        # Statement over the chunks parsed so far, rebuilt every PARTIAL_PIECES finished chunks. It runs on the script
+        # thread, so only the date and amount orderings are built; rollups and search follow if the page uses them.
+        with self._lock:
+            if self.statement is not None or self.frames is None:
+                return self.statement
+            step = self.partial_step
+            if self._partial[0] == step:
+                return self._partial[1]
+            frames = [self.frames[index] for index in sorted(self.frames)]
+        statement = Statement(concat_frames(frames)) if frames else None
+        self._partial = (step, statement)
+        return statement
+
+
+def find_job(identifier):
+    with _jobs_lock:
+        return _jobs.get(identifier)
+
+
+def forget_job(job):
+    with _jobs_lock:
+        if _jobs.get(job.id) is job:
+            del _jobs[job.id]
+
+
+def submit_job(key, bank, source, on_done=None):
+    # Returns the job already registered for this key, running or finished, or starts a new one.
+    with _jobs_lock:
+        job = _jobs.get(job_id(key))
+        if job is None:
+            job = _jobs[job_id(key)] = IngestJob(key, bank, source, on_done)
+            runner().submit(job.run)
+        return job
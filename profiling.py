@@ -0,0 +1,160 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+from types import SimpleNamespace
+
+import pandas as pd
+import streamlit as st
+
+# Opt-in: when off, stage() hands back one shared no-op context and instrument() returns functions untouched.
+ENABLED = os.environ.get("APP_PROFILE", "").lower() in ("1", "true", "yes")
+METRICS = (
+    ("calls", "Calls of the stage."),
+    ("seconds", "Time spent in the stage."),
+    ("rows_in", "Rows handed to the stage."),
+    ("rows_out", "Rows produced by the stage."),
+)
+
+_run = threading.local()
+_totals = {}
+_totals_lock = threading.Lock()
+_disabled = nullcontext(SimpleNamespace())
+
+
+class Stage:
+    def __init__(self, name, depth, rows_in):
+        self.name = name
+        self.depth = depth
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.seconds = None
+        self.rss_before = rss_bytes()
+        self.rss_after = None
+
+    def as_dict(self):
+        return dict(vars(self))
+
+
+def rss_bytes():
+    # Current resident set size, where /proc is available.
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def begin_run():
+    # Called at the top of a script so the panel only shows the current rerun. Each session reruns on its own thread.
+    if ENABLED:
+        _run.stages = []
+        _run.depth = 0
+        _run.started = time.perf_counter()
+
+
+def run_stages():
+    return list(getattr(_run, "stages", []))
+
+
+def totals():
+    with _totals_lock:
+        return {name: dict(values) for name, values in _totals.items()}
+
+
+def _count(rows):
+    return rows() if callable(rows) else rows
+
+
+@contextmanager
+def _stage(name, rows_in):
+    if not hasattr(_run, "stages"):
+        begin_run()
+    record = Stage(name, _run.depth, _count(rows_in))
+    _run.stages.append(record)
+    _run.depth += 1
+    started = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record.seconds = time.perf_counter() - started
+        record.rss_after = rss_bytes()
+        record.rows_out = _count(record.rows_out)
+        _run.depth = record.depth
+        with _totals_lock:
+            values = _totals.setdefault(name, {metric: 0 for metric, _ in METRICS})
+            values["calls"] += 1
+            values["seconds"] += record.seconds
+            values["rows_in"] += record.rows_in or 0
+            values["rows_out"] += record.rows_out or 0
+
+
+def stage(name, rows_in=None):
+    # Times a block. Set `rows_out` on the yielded record to count what the block produced. Either count can be a
+    # callable, so one that costs a pass over the data is only taken when profiling is on.
+    return _stage(name, rows_in) if ENABLED else _disabled
+
+
+def instrument(name, rows_in=None, rows_out=None):
+    # Times every call of the decorated function. rows_in is called with its arguments, rows_out with its result.
+    def decorate(fn):
+        if not ENABLED:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with _stage(name, rows_in(*args, **kwargs) if rows_in is not None else None) as record:
+                result = fn(*args, **kwargs)
+                if rows_out is not None and result is not None:
+                    record.rows_out = rows_out(result)
+                return result
+        return wrapper
+    return decorate
+
+
+def to_json(stages, extra=None):
+    return json.dumps({"stages": [record.as_dict() for record in stages], "totals": totals(), **(extra or {})},
+                      default=str, indent=2)
+
+
+def to_prometheus():
+    # Cumulative stage counters of this process in the Prometheus text format.
+    lines = []
+    stage_totals = totals()
+    for metric, description in METRICS:
+        name = f"app_stage_{metric}_total"
+        lines += [f"# HELP {name} {description}", f"# TYPE {name} counter"]
+        lines += [f'{name}{{stage="{stage_name}"}} {values[metric]}' for stage_name, values in sorted(stage_totals.items())]
+    rss = rss_bytes()
+    if rss is not None:
+        lines += ["# HELP app_resident_memory_bytes Resident memory of the app process.",
+                  "# TYPE app_resident_memory_bytes gauge", f"app_resident_memory_bytes {rss}"]
+    return "\n".join(lines) + "\n"
+
+
+def profile_panel(extra=None):
+    # Collapsible breakdown of the current rerun with cumulative exports. Renders nothing unless profiling is on.
+    if not ENABLED:
+        return
+    stages = run_stages()
+    with st.expander("Profiling"):
+        st.caption(f"Rerun so far: {(time.perf_counter() - _run.started) * 1000:.1f} ms")
+        st.table(pd.DataFrame([{
+            "Stage": "· " * record.depth + record.name,
+            "ms": round(record.seconds * 1000, 2) if record.seconds is not None else None,
+            "Rows in": record.rows_in,
+            "Rows out": record.rows_out,
+            "RSS MB": round(record.rss_after / 1e6, 1) if record.rss_after is not None else None,
+            "Δ RSS MB": round((record.rss_after - record.rss_before) / 1e6, 1)
+            if record.rss_after is not None and record.rss_before is not None else None,
+        } for record in stages], columns=["Stage", "ms", "Rows in", "Rows out", "RSS MB", "Δ RSS MB"]))
+        for title, values in (extra or {}).items():
+            st.caption(title)
+            st.json(values, expanded=False)
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("Export JSON", to_json(stages, extra), "profile.json", "application/json")
+        with col2:
+            st.download_button("Export Prometheus", to_prometheus(), "metrics.prom", "text/plain")
@@ -0,0 +1,99 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+TOKEN = r"[^\W_]+"
+# The same word tokens as TOKEN, written as the separator pattern for Arrow's RE2 split.
+NON_TOKEN = r"[^\pL\pN]+"
+# Above this many matching vocabulary tokens a query expands postings with one vectorized mask instead of a loop.
+LOOP_LIMIT = 512
+# Word pieces whose postings cover more than this share of rows are cheaper to confirm with a plain scan.
+SELECTIVE_FRACTION = 0.2
+
+
+class SearchIndex:
+    # Inverted index from lowercased word tokens to the positions of the texts containing them, stored as one
+    # sorted postings array with per-token offsets. A substring query picks the tokens that contain each of its
+    # word pieces, intersects their postings and then confirms the exact substring on those candidates only.
+    def __init__(self, texts):
+        # Tokenized with Arrow kernels: texts are split at whitespace, only the distinct words are split further
+        # into word tokens, and those are mapped back onto every occurrence, since statements repeat few words.
+        self.lower = pd.Series(texts, dtype="string[pyarrow]").fillna("").str.lower().reset_index(drop=True)
+        texts = pa.array(self.lower.array)
+        if isinstance(texts, pa.ChunkedArray):
+            texts = texts.combine_chunks()
+        words = pc.utf8_split_whitespace(texts)
+        encoded = pc.dictionary_encode(pc.list_flatten(words))
+        pieces = pc.split_pattern_regex(encoded.dictionary, NON_TOKEN)
+        flat = pc.list_flatten(pieces)
+        kept = pc.not_equal(flat, "")
+        piece_codes, vocabulary = pd.factorize(pd.arrays.ArrowStringArray(pc.filter(flat, kept)), sort=True)
+        piece_words = pc.list_parent_indices(pieces).to_numpy()[kept.to_numpy(zero_copy_only=False)]
+        counts = np.bincount(piece_words, minlength=len(encoded.dictionary))
+        starts = np.cumsum(counts) - counts
+
+        word_codes = encoded.indices.to_numpy()
+        repeats = counts[word_codes]
+        within = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        codes = piece_codes[np.repeat(starts[word_codes], repeats) + within]
+        rows = np.repeat(pc.list_parent_indices(words).to_numpy(), repeats)
+        # Rows are ascending already, so a stable sort by token keeps each postings list sorted.
+        order = np.argsort(codes, kind="stable")
+        codes, rows = codes[order], rows[order]
+        keep = np.ones(len(rows), dtype=bool)
+        keep[1:] = (codes[1:] != codes[:-1]) | (rows[1:] != rows[:-1])
+        codes, self.rows = codes[keep], rows[keep].astype(np.int32)
+        self.vocabulary = pd.Series(vocabulary, dtype="string[pyarrow]")
+        self.offsets = np.searchsorted(codes, np.arange(len(vocabulary) + 1))
+
+    def __len__(self):
+        return len(self.lower)
+
+    @property
+    def nbytes(self):
+        return int(self.rows.nbytes + self.offsets.nbytes + self.vocabulary.memory_usage(deep=True)
+                   + self.lower.memory_usage(deep=True))
+
+    def _matching_tokens(self, piece):
+        tokens = np.flatnonzero(self.vocabulary.str.contains(piece, regex=False).to_numpy(dtype=bool))
+        return tokens, int((self.offsets[tokens + 1] - self.offsets[tokens]).sum())
+
+    def _postings(self, tokens):
+        if len(tokens) <= LOOP_LIMIT:
+            postings = [self.rows[self.offsets[token]:self.offsets[token + 1]] for token in tokens]
+            return np.unique(np.concatenate(postings)) if postings else np.empty(0, dtype=np.int32)
+        matched = np.zeros(len(self.vocabulary), dtype=bool)
+        matched[tokens] = True
+        return np.unique(self.rows[np.repeat(matched, np.diff(self.offsets))])
+
+    def _candidates(self, query):
+        # Positions that can contain the query, or None when no word piece narrows the search enough to beat
+        # a plain scan. Pieces are intersected from the most selective one onwards.
+        limit = len(self.lower) * SELECTIVE_FRACTION
+        pieces = sorted((self._matching_tokens(piece) for piece in set(re.findall(TOKEN, query))),
+                        key=lambda match: match[1])
+        candidates = None
+        for tokens, size in pieces:
+            if size > limit:
+                break
+            postings = self._postings(tokens)
+            candidates = postings if candidates is None else np.intersect1d(candidates, postings, assume_unique=True)
+            if len(candidates) == 0:
+                break
+        return candidates
+
+    def scan(self, text):
+        # Sorted positions of texts containing `text`, by checking every text.
+        return np.flatnonzero(self.lower.str.contains(text.lower(), regex=False).to_numpy(dtype=bool))
+
+    def search(self, text):
+        # Sorted positions of texts containing `text` as a case-insensitive substring.
+        query = text.lower()
+        candidates = self._candidates(query)
+        if candidates is None:
+            return self.scan(query)
+        found = self.lower.take(candidates).str.contains(query, regex=False).to_numpy(dtype=bool)
+        return candidates[found]
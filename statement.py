@@ -0,0 +1,171 @@
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+
+from search import SearchIndex
+
+DATE_FORMAT = "%d/%m/%y"
+DEDUP_COLUMNS = ["date", "ref", "debit_paise", "credit_paise", "balance_paise"]
+TRANSACTION_TYPES = {"DEBIT": "debit_paise", "CREDIT": "credit_paise"}
+ALL = "All"
+PAISE = 100
+
+
+def to_paise(amounts):
+    # Rupee amounts as exact integer paise. Statement amounts have at most two decimals, so rounding the parsed
+    # float recovers them exactly, and totals summed in paise do not drift the way float rupee sums do.
+    return (pd.to_numeric(amounts, errors="coerce") * PAISE).round().astype("Int64")
+
+
+def to_rupees(paise):
+    return paise / PAISE
+
+
+def financial_years(dates):
+    # Indian financial years run April to March and are labelled by both calendar years, e.g. FY2023-24.
+    start = dates.dt.year - (dates.dt.month < 4)
+    return "FY" + start.astype(str) + "-" + ((start + 1) % 100).astype(str).str.zfill(2)
+
+
+def fy_quarters(dates):
+    return "Q" + ((dates.dt.month - 4) % 12 // 3 + 1).astype(str)
+
+
+def dividend_rollups(frame):
+    dividends = frame[frame["dividend"] & frame["date"].notna()]
+    dividends = dividends.assign(fy=financial_years(dividends["date"]), quarter=fy_quarters(dividends["date"]),
+                                 payer=dividends["payer"].astype(object))
+    totals = {"Total": ("credit_paise", "sum"), "Count": ("credit_paise", "count")}
+
+    def rollup(keys):
+        return dividends.groupby(keys).agg(**totals).assign(Total=lambda rolled: to_rupees(rolled["Total"]))
+
+    by_payer = rollup(["fy", "payer"])
+    return {
+        "by_fy": rollup("fy").sort_index(ascending=False),
+        "by_quarter": rollup(["fy", "quarter"]),
+        "by_payer": by_payer.sort_values("Total", ascending=False).sort_index(level=0, sort_remaining=False),
+        "rows": {**dividends.groupby("fy").indices, **dividends.groupby(["fy", "payer"]).indices},
+        "positions": dividends.index.to_numpy(),
+    }
+
+
+class Statement:
+    # Parsed statement rows sorted by date, with the indexes the analysis panel queries. Amounts are int64 paise.
+    # The date and amount orderings are built up front; dividend rollups and the search index on first use.
+    def __init__(self, frame):
+        self.frame = frame.sort_values("date", kind="stable", na_position="last", ignore_index=True)
+        dates = self.frame["date"].to_numpy()
+        self.dates = dates[:int(self.frame["date"].notna().sum())]
+        self.amount_order = {}
+        self.sorted_amounts = {}
+        for transaction_type, column in TRANSACTION_TYPES.items():
+            amounts = self.frame[column].to_numpy()
+            order = np.argsort(amounts, kind="stable")
+            self.amount_order[transaction_type] = order
+            self.sorted_amounts[transaction_type] = amounts[order]
+
+    @cached_property
+    def rollups(self):
+        return dividend_rollups(self.frame)
+
+    @cached_property
+    def search(self):
+        # Built on the first 'Contains' query, since most statements are never searched.
+        return SearchIndex(self.frame["summary"])
+
+    def __len__(self):
+        return len(self.frame)
+
+    @property
+    def nbytes(self):
+        index_bytes = sum(array.nbytes for array in self.amount_order.values())
+        index_bytes += sum(array.nbytes for array in self.sorted_amounts.values())
+        if "search" in self.__dict__:
+            index_bytes += self.search.nbytes
+        return int(self.frame.memory_usage(deep=True).sum()) + index_bytes
+
+    def date_range(self):
+        if len(self.dates) == 0:
+            return None, None
+        return self.dates[0].astype("datetime64[D]").item(), self.dates[-1].astype("datetime64[D]").item()
+
+    def date_slice(self, from_date, to_date):
+        start = np.searchsorted(self.dates, np.datetime64(from_date).astype(self.dates.dtype), "left")
+        stop = np.searchsorted(self.dates, np.datetime64(to_date).astype(self.dates.dtype), "right")
+        return slice(int(start), int(max(start, stop)))
+
+    def select(self, transaction_type, min_amount, max_amount, from_date, to_date):
+        # Row positions within both ranges, in date order. Scans whichever of the two index ranges is smaller.
+        dated = self.date_slice(from_date, to_date)
+        min_amount, max_amount = round(min_amount * PAISE), round(max_amount * PAISE)
+        sorted_amounts = self.sorted_amounts[transaction_type]
+        low = np.searchsorted(sorted_amounts, min_amount, "left")
+        high = np.searchsorted(sorted_amounts, max_amount, "right")
+        if dated.stop - dated.start <= high - low:
+            amounts = self.frame[TRANSACTION_TYPES[transaction_type]].to_numpy()[dated]
+            return np.flatnonzero((amounts >= min_amount) & (amounts <= max_amount)) + dated.start
+        rows = self.amount_order[transaction_type][low:high]
+        return np.sort(rows[(rows >= dated.start) & (rows < dated.stop)])
+
+    def financial_years(self):
+        return list(self.rollups["by_fy"].index)
+
+    def payers(self, fy):
+        by_payer = self.rollups["by_payer"]
+        return by_payer.loc[fy] if fy in by_payer.index.get_level_values(0) else by_payer.iloc[:0].droplevel(0)
+
+    def quarters(self, fy):
+        by_quarter = self.rollups["by_quarter"]
+        return by_quarter.loc[fy] if fy in by_quarter.index.get_level_values(0) else by_quarter.iloc[:0].droplevel(0)
+
+    def calculate_dividend(self, fy=ALL, payer=ALL):
+        if fy == ALL:
+            positions = self.rollups["positions"]
+            if payer != ALL:
+                positions = positions[self.frame["payer"].take(positions).to_numpy() == payer]
+        else:
+            key = fy if payer == ALL else (fy, payer)
+            positions = self.rollups["positions"][self.rollups["rows"].get(key, [])]
+        dividends = self.frame.take(positions)
+        return {
+            "res_dividend": to_rupees(int(dividends["credit_paise"].sum())),
+            "res_dataframe": {
+                'Date': dividends["date"],
+                'Payer': dividends["payer"],
+                'Summary': dividends["summary"].str.strip(),
+                'Credit Amount': to_rupees(dividends["credit_paise"]),
+            }
+        }
+
+    def analyse(self, transaction_type, threshold_amount, max_amount, from_date, to_date, contains_text):
+        positions = self.select(transaction_type, threshold_amount, max_amount, from_date, to_date)
+        if contains_text and len(contains_text.strip()) > 0:
+            positions = np.intersect1d(positions, self.search.search(contains_text), assume_unique=True)
+        rows = self.frame.take(positions)
+        paise = rows[TRANSACTION_TYPES[transaction_type]]
+        return {
+            "res_total": to_rupees(int(paise.sum())),
+            "res_dataframe": {
+                'Date': rows["date"],
+                'Summary': rows["summary"].str.strip(),
+                'Amount': to_rupees(paise),
+            }
+        }
+
+
+def concat_frames(frames):
+    frame = pd.concat(frames, ignore_index=True)
+    frame["bank"] = frame["bank"].astype("category")
+    return frame
+
+
+def merge_statements(statements):
+    # Overlapping statement periods repeat the same transactions, so rows are deduplicated on
+    # date, reference, amounts and running balance. Identical rows within one file are genuine repeats:
+    # each is numbered by its occurrence in its own file and only the same occurrence in another file is dropped.
+    frame = concat_frames([statement.frame.assign(occurrence=statement.frame.groupby(
+        DEDUP_COLUMNS, dropna=False).cumcount()) for statement in statements])
+    frame = frame.drop_duplicates(subset=DEDUP_COLUMNS + ["occurrence"], ignore_index=True)
+    return Statement(frame.drop(columns="occurrence"))
@@ -0,0 +1,136 @@
+import os
+import sqlite3
+from contextlib import closing
+from datetime import date
+
+import pandas as pd
+
+from statement import PAISE, Statement, TRANSACTION_TYPES, to_paise, to_rupees
+
+# Opt-in: statements are personal data, so nothing is written to disk unless a path is configured.
+STORE_PATH = os.environ.get("TRANSACTION_STORE")
+CARD_BANK = "HDFCCC"
+KEY_COLUMNS = ["date", "ref", "summary", "debit_paise", "credit_paise", "balance_paise"]
+COLUMNS = ["account", "bank", "date", "summary", "ref", "debit_paise", "credit_paise", "balance_paise", "dividend",
+           "payer", "seq"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transactions (
+    account TEXT NOT NULL,
+    bank TEXT NOT NULL,
+    date TEXT,
+    summary TEXT NOT NULL DEFAULT '',
+    ref TEXT NOT NULL DEFAULT '',
+    debit_paise INTEGER NOT NULL DEFAULT 0,
+    credit_paise INTEGER NOT NULL DEFAULT 0,
+    balance_paise INTEGER,
+    dividend INTEGER NOT NULL DEFAULT 0,
+    payer TEXT,
+    seq INTEGER NOT NULL DEFAULT 0
+);
+CREATE UNIQUE INDEX IF NOT EXISTS transactions_key
+    ON transactions (account, IFNULL(date, ''), ref, summary, debit_paise, credit_paise, IFNULL(balance_paise, ''), seq);
+CREATE INDEX IF NOT EXISTS transactions_date ON transactions (account, date);
+CREATE INDEX IF NOT EXISTS transactions_debit ON transactions (account, debit_paise);
+CREATE INDEX IF NOT EXISTS transactions_credit ON transactions (account, credit_paise);
+"""
+
+class TransactionStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def append(self, account, frame):
+        # Inserts only rows not stored yet. Identical rows within one upload (two equal payments on the same
+        # day) are told apart by their occurrence number, which is the same every time the file is ingested.
+        rows = pd.DataFrame({
+            "account": account,
+            "bank": frame["bank"].astype(str),
+            "date": frame["date"].dt.strftime("%Y-%m-%d").astype(object),
+            "summary": frame["summary"].astype(object).fillna(""),
+            "ref": frame["ref"].astype(object).fillna(""),
+            "debit_paise": frame["debit_paise"],
+            "credit_paise": frame["credit_paise"],
+            "balance_paise": frame["balance_paise"],
+            "dividend": frame["dividend"].astype(int),
+            "payer": frame["payer"].astype(object),
+        })
+        rows["seq"] = rows.groupby(KEY_COLUMNS, dropna=False).cumcount()
+        rows = rows.astype(object).where(rows.notna(), None)
+        with closing(self._connect()) as conn, conn:
+            before = conn.total_changes
+            conn.executemany(f"INSERT OR IGNORE INTO transactions ({', '.join(COLUMNS)}) "
+                             f"VALUES ({', '.join('?' * len(COLUMNS))})", rows[COLUMNS].itertuples(index=False))
+            return conn.total_changes - before
+
+    def load(self, account):
+        with closing(self._connect()) as conn:
+            frame = pd.read_sql_query("SELECT date, summary, ref, debit_paise, credit_paise, balance_paise, bank, "
+                                      "dividend, payer FROM transactions WHERE account = ? ORDER BY date, rowid",
+                                      conn, params=(account,))
+        frame["date"] = pd.to_datetime(frame["date"], format="%Y-%m-%d")
+        frame["balance_paise"] = frame["balance_paise"].astype("Int64")
+        frame["summary"] = frame["summary"].astype("string[pyarrow]")
+        frame["ref"] = frame["ref"].astype("string[pyarrow]")
+        frame["payer"] = frame["payer"].astype("string[pyarrow]")
+        frame["bank"] = frame["bank"].astype("category")
+        frame["dividend"] = frame["dividend"].astype(bool)
+        return Statement(frame)
+
+    def date_range(self, account):
+        with closing(self._connect()) as conn:
+            first, last = conn.execute("SELECT MIN(date), MAX(date) FROM transactions WHERE account = ?",
+                                       (account,)).fetchone()
+        if first is None:
+            return None, None
+        return date.fromisoformat(first), date.fromisoformat(last)
+
+    def query(self, account, transaction_type, min_amount, max_amount, from_date, to_date, contains_text=None):
+        column = TRANSACTION_TYPES[transaction_type]
+        sql = f"SELECT date, summary, {column} FROM transactions " \
+              f"WHERE account = ? AND date BETWEEN ? AND ? AND {column} BETWEEN ? AND ?"
+        params = [account, from_date.isoformat(), to_date.isoformat(), round(min_amount * PAISE),
+                  round(max_amount * PAISE)]
+        if contains_text and len(contains_text.strip()) > 0:
+            escaped = contains_text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            sql += " AND summary LIKE ? ESCAPE '\\'"
+            params.append(f"%{escaped}%")
+        with closing(self._connect()) as conn:
+            rows = pd.read_sql_query(sql + " ORDER BY date, rowid", conn, params=params)
+        return {
+            "res_total": to_rupees(int(rows[column].sum())),
+            "res_dataframe": {
+                'Date': pd.to_datetime(rows["date"], format="%Y-%m-%d"),
+                'Summary': rows["summary"].str.strip(),
+                'Amount': to_rupees(rows[column]),
+            }
+        }
+
+
+def card_transactions(statement_date, df):
+    # Normalizes a fetched credit card statement into the same shape as a parsed bank statement.
+    debit = df['transactionType'] == 'DEBIT'
+    paise = to_paise(df['amount']).fillna(0).astype("int64")
+    dates = pd.to_datetime(df['date'], errors="coerce", format="ISO8601")
+    dates = dates.fillna(pd.to_datetime(df['date'], errors="coerce", format="mixed", dayfirst=True))
+    return pd.DataFrame({
+        "date": dates,
+        "summary": df['description'],
+        "ref": statement_date,
+        "debit_paise": paise.where(debit, 0),
+        "credit_paise": paise.where(~debit, 0),
+        "balance_paise": pd.Series(pd.NA, index=df.index, dtype="Int64"),
+        "bank": CARD_BANK,
+        "dividend": False,
+        "payer": None,
+    })
+
+
+def get_store():
+    return TransactionStore() if STORE_PATH else None
@@ -0,0 +1,44 @@
+import math
+
+import streamlit as st
+
+from formatting import format_inr
+from profiling import stage
+
+PAGE_SIZES = (25, 50, 100, 500)
+DEFAULT_ORDER = "Default"
+
+
+def paged_table(df, key, sortable=True, date_format=None, amount_columns=()):
+    # Sorts the full result server side but only serializes the visible page, so large results stay cheap to send.
+    if df.empty:
+        st.table(df)
+        return
+    controls = st.columns(4 if sortable else 2)
+    if sortable:
+        with controls[0]:
+            sort_by = st.selectbox("Sort by", (DEFAULT_ORDER, *df.columns), key=f"{key}_sort")
+        with controls[1]:
+            descending = st.toggle("Descending", key=f"{key}_descending")
+        if sort_by != DEFAULT_ORDER:
+            df = df.sort_values(sort_by, ascending=not descending, kind="stable")
+    with controls[-2]:
+        page_size = st.selectbox("Rows per page", PAGE_SIZES, key=f"{key}_size")
+    pages = max(1, math.ceil(len(df) / page_size))
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    with controls[-1]:
+        page = st.number_input(f"Page (of {pages})", min_value=1, max_value=pages, step=1, key=page_key)
+
+    start = (page - 1) * page_size
+    with stage("render", rows_in=len(df)) as timing:
+        window = df.iloc[start:start + page_size].copy()
+        if date_format is not None:
+            for column in window.select_dtypes("datetime").columns:
+                window[column] = window[column].dt.strftime(date_format)
+        for column in amount_columns:
+            window[column] = format_inr(window[column])
+        st.table(window)
+        timing.rows_out = len(window)
+    st.caption(f"Showing rows {start + 1}-{start + len(window)} of {len(df)}")